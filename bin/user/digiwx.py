@@ -83,6 +83,8 @@ from __future__ import with_statement, print_function
 
 # this driver uses pyserial, not serial!  both import serial, but they are very
 # different serial implementations!
+import functools
+import re
 import serial
 import time
 
@@ -92,6 +94,27 @@ import weewx.units
 DRIVER_NAME = 'DigiWX'
 DRIVER_VERSION = '0.1'
 
+# match only the head of the line - the fields we use (1-5 and 8) are
+# all within the first 9.  the rest of the 53-field frame is validated
+# separately with a delimiter count.
+CURRENT_RE = re.compile(
+    r'^DW,([-+]?\d+),([-+]?\d+),(\d+),(\d+),(\d+),[^,]*,[^,]*'
+    r',(\d+(?:\.\d+)?),')
+
+
+# the station often emits identical lines back-to-back, so remember the
+# values from recently seen lines.  the cached value is a tuple, not a
+# dict, so that callers cannot mutate a cached object.
+@functools.lru_cache(maxsize=16)
+def parse_values(s):
+    if s.count(',') != 52:
+        return None
+    m = CURRENT_RE.match(s)
+    if m is None:
+        return None
+    return (int(m.group(1)), int(m.group(2)), int(m.group(3)),
+            int(m.group(4)), int(m.group(5)), float(m.group(6)))
+
 
 def C_to_F(x):
     return weewx.units.CtoF(x) if x is not None else None
@@ -112,23 +135,32 @@ try:
     # WeeWX4 logging
     import logging
     log = logging.getLogger(__name__)
-    def logdbg(msg):
-        log.debug(msg)
-    def loginf(msg):
-        log.info(msg)
-    def logerr(msg):
-        log.error(msg)
+    def logdbg_enabled():
+        return log.isEnabledFor(logging.DEBUG)
+    def logdbg(msg, *args):
+        log.debug(msg, *args)
+    def loginf(msg, *args):
+        log.info(msg, *args)
+    def logerr(msg, *args):
+        log.error(msg, *args)
 except ImportError:
     # WeeWX legacy (v3) logging via syslog
     import syslog
-    def logmsg(level, msg):
+    def logdbg_enabled():
+        # setlogmask(0) queries the current mask without changing it
+        return bool(syslog.setlogmask(0) & syslog.LOG_MASK(syslog.LOG_DEBUG))
+    def logmsg(level, msg, args):
+        if args:
+            msg = msg % args
         syslog.syslog(level, 'digiwx: %s' % msg)
-    def logdbg(msg):
-        logmsg(syslog.LOG_DEBUG, msg)
-    def loginf(msg):
-        logmsg(syslog.LOG_INFO, msg)
-    def logerr(msg):
-        logmsg(syslog.LOG_ERR, msg)
+    def logdbg(msg, *args):
+        # format debug messages only when debug is enabled
+        if logdbg_enabled():
+            logmsg(syslog.LOG_DEBUG, msg, args)
+    def loginf(msg, *args):
+        logmsg(syslog.LOG_INFO, msg, args)
+    def logerr(msg, *args):
+        logmsg(syslog.LOG_ERR, msg, args)
 
 
 class DigiWXConfigurationEditor(weewx.drivers.AbstractConfEditor):
@@ -154,8 +186,10 @@ class DigiWXConfigurationEditor(weewx.drivers.AbstractConfEditor):
 
 class DigiWXDriver(weewx.drivers.AbstractDevice):
     def __init__(self, **stn_dict):
-        loginf('driver version is %s' % DRIVER_VERSION)
+        loginf('driver version is %s', DRIVER_VERSION)
         self._model = stn_dict.get('model', 'WRL')
+        self._last_raw = None
+        self._last_data = None
         port = stn_dict.get('port', DigiWXStation.DEFAULT_PORT)
         self._station = DigiWXStation(port)
         self._station.open()
@@ -171,9 +205,17 @@ class DigiWXDriver(weewx.drivers.AbstractDevice):
         while True:
             raw = self._station.get_current()
             if raw:
-                logdbg("raw data: %s" % raw)
-                data = DigiWXStation.parse_current(raw)
-                logdbg("parsed data: %s" % data)
+                logdbg("raw data: %s", raw)
+                # the station often repeats the previous line verbatim, so
+                # compare before parsing - a string compare is much cheaper
+                # than a parse.
+                if raw == self._last_raw:
+                    data = self._last_data
+                else:
+                    data = DigiWXStation.parse_current(raw)
+                    self._last_raw = raw
+                    self._last_data = data
+                logdbg("parsed data: %s", data)
                 if data:
                     packet = self._data_to_packet(data)
                     yield packet
@@ -181,8 +223,12 @@ class DigiWXDriver(weewx.drivers.AbstractDevice):
                     time.sleep(0.5)
 
     def _data_to_packet(self, data):
+        # each packet must be a new dict: the weewx engine hands loop
+        # packets to accumulators and services that hold references to
+        # them well after the next packet is emitted.
         pkt = {
-            'dateTime': int(time.time() + 0.5),
+            # round to the nearest second on an integer-only path
+            'dateTime': (time.time_ns() + 500000000) // 1000000000,
             'usUnits': weewx.US,
             'windDir': data.get('wind_dir'), # degree
             'windSpeed': knot_to_mph(data.get('wind_speed')), # knot
@@ -197,6 +243,7 @@ class DigiWXDriver(weewx.drivers.AbstractDevice):
 class DigiWXStation(object):
     DEFAULT_PORT = '/dev/ttyS0'
     DEFAULT_BAUD = 9600
+    MAX_BUFLEN = 4096 # lines are ~250 bytes; more with no newline is garbage
 
     def __init__(self, port, baud=9600):
         self.port = port
@@ -205,6 +252,8 @@ class DigiWXStation(object):
         self.max_tries = 3
         self.retry_wait = 3
         self.serial_port = None
+        self._buf = bytearray()
+        self._bad_frames = 0
 
     def __enter__(self):
         self.open()
@@ -214,27 +263,46 @@ class DigiWXStation(object):
         self.close()
 
     def open(self):
-        logdbg("open serial port %s" % self.port)
+        logdbg("open serial port %s", self.port)
+        del self._buf[:]
         self.serial_port = serial.Serial(
             self.port, self.baudrate, timeout=self.timeout)
 
     def close(self):
         if self.serial_port is not None:
-            logdbg("close serial port %s" % self.port)
+            logdbg("close serial port %s", self.port)
             self.serial_port.close()
             self.serial_port = None
 
     def get_data(self):
-        buf = ''
+        # accumulate reads in a persistent buffer and frame on newline.
+        # one read of whatever is pending replaces readline's internal
+        # byte-at-a-time loop, and find is a C-level scan.
+        while True:
+            i = self._buf.find(b'\n')
+            if i >= 0:
+                line = bytes(self._buf[:i])
+                del self._buf[:i + 1]
+                break
+            chunk = self.serial_port.read(self.serial_port.in_waiting or 1)
+            if not chunk:
+                # read timed out with no line available
+                return ''
+            self._buf += chunk
+            if len(self._buf) > DigiWXStation.MAX_BUFLEN:
+                # data keep arriving with no newline - probably a bad baud
+                # rate or a babbling device.  discard rather than grow.
+                logerr("no newline in %d bytes; discarding buffer",
+                       len(self._buf))
+                del self._buf[:]
+                return ''
         try:
-            buf = self.serial_port.readline()
-            # readline returns 'bytes' so convert to string
-            buf = buf.decode('ascii')
-            buf = buf.strip()
-            logdbg("station said: %s" % buf)
+            # the station speaks ascii, so convert bytes to string
+            buf = line.decode('ascii').strip()
         except UnicodeDecodeError as e:
-            logerr("decode failed: %s" % e)
-            buf = ''
+            logerr("decode failed: %s", e)
+            return ''
+        logdbg("station said: %s", buf)
         return buf
 
     def get_data_with_retry(self):
@@ -243,48 +311,64 @@ class DigiWXStation(object):
                 buf = self.get_data()
                 return buf
             except (serial.serialutil.SerialException, weewx.WeeWxIOError) as e:
-                loginf("Failed attempt %d of %d to get readings: %s"
-                       % (ntries + 1, self.max_tries, e))
+                loginf("Failed attempt %d of %d to get readings: %s",
+                       ntries + 1, self.max_tries, e)
                 time.sleep(self.retry_wait)
         else:
-            msg = "Max retries (%d) exceeded for command '%s'" \
-                  % (self._max_tries, cmd)
+            msg = "Max retries (%d) exceeded" % self.max_tries
             logerr(msg)
             raise weewx.RetriesExceeded(msg)
 
     def get_current(self):
-        return self.get_data_with_retry()
+        buf = self.get_data_with_retry()
+        if buf and not DigiWXStation.verify(buf):
+            self._bad_frames += 1
+            logerr("checksum mismatch (%d bad frames): %s",
+                   self._bad_frames, buf)
+            buf = ''
+        return buf
+
+    @staticmethod
+    def verify(s):
+        # the last field of each line is a 2-digit hex checksum: the xor
+        # of every byte up to and including the final comma
+        try:
+            cksum = int(s[-2:], 16)
+        except ValueError:
+            return False
+        x = 0
+        for b in s[:-2].encode('ascii', 'replace'):
+            x ^= b
+        return x == cksum
 
     @staticmethod
     def parse_current(s):
-        parts = s.split(',')
         data = dict()
-        if len(parts) == 53:
+        values = parse_values(s)
+        if values:
             data = {
-                'temperature': DigiWXStation.parse_int(parts[1]), # C
-                'dewpoint': DigiWXStation.parse_int(parts[2]), # C
-                'humidity': DigiWXStation.parse_int(parts[3]), # %
-                'wind_dir': DigiWXStation.parse_int(parts[4]), # degree
-                'wind_speed': DigiWXStation.parse_int(parts[5]), # knot
-                'pressure': DigiWXStation.parse_float(parts[8]), # inHg
+                'temperature': values[0], # C
+                'dewpoint': values[1], # C
+                'humidity': values[2], # %
+                'wind_dir': values[3], # degree
+                'wind_speed': values[4], # knot
+                'pressure': values[5], # inHg
             }
         return data
 
     @staticmethod
-    def parse_int(s):
-        try:
-            return int(s)
-        except ValueError:
-            pass
-        return None
-
-    @staticmethod
-    def parse_float(s):
-        try:
-            return float(s)
-        except ValueError:
-            pass
-        return None
+    def parse_batch(lines):
+        # parse a batch of raw lines, for example when replaying a logged
+        # data file.  accept bytes since replay files are typically read
+        # in binary mode.  lines that do not parse are dropped.
+        data = []
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('ascii', 'replace')
+            parsed = DigiWXStation.parse_current(line.strip())
+            if parsed:
+                data.append(parsed)
+        return data
 
 
 # define a main entry point for basic testing of the station without weewx